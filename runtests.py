@@ -12,9 +12,25 @@ if django.VERSION >= (1, 7):
     django.setup()
 
 
+def get_parallel():
+    parallel = os.environ.get('TEST_PARALLEL', '1')
+    if parallel == 'auto':
+        try:
+            from django.test.runner import get_max_test_processes
+        except ImportError:  # Django < 4.1
+            from django.test.runner import default_test_processes as get_max_test_processes
+        return get_max_test_processes()
+    return int(parallel)
+
+
 def runtests():
     TestRunner = get_runner(settings)
-    test_runner = TestRunner(verbosity=1, interactive=True)
+    test_runner = TestRunner(
+        verbosity=1,
+        interactive=True,
+        parallel=get_parallel(),
+        keepdb=bool(os.environ.get('TEST_KEEPDB')),
+    )
     failures = test_runner.run_tests(['tests'])
     sys.exit(bool(failures))
 
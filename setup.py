@@ -47,7 +47,9 @@ setup(
     tests_require=[
         'django>=1.11',
         'twilio==4.4.0',
-        'mock>=1.0'
+        'mock>=1.0',
+        'time-machine',
+        'tblib',
     ],
     license='MIT',
     test_suite='runtests.runtests',
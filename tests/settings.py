@@ -9,6 +9,9 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.environ.get('DB_NAME', ':memory:'),
+        'TEST': {
+            'NAME': os.environ.get('TEST_DB_NAME'),
+        },
     }
 }
 
@@ -34,6 +37,10 @@ AUTHENTICATION_BACKENDS = (
     'django.contrib.auth.backends.ModelBackend'
 )
 
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.MD5PasswordHasher',
+]
+
 TIME_ZONE = 'America/Chicago'
 LANGUAGE_CODE = 'en-us'
 STATICFILES_FINDERS = (
@@ -1,58 +1,80 @@
 # -*- coding: utf8 -*-
 import time
 from datetime import datetime
-from unittest.mock import patch
 
+import django
+import time_machine
 from django.contrib.auth import authenticate, get_user_model
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
 from django.test.utils import override_settings
 from django.utils import timezone
 
 from nopassword.models import LoginCode
 
+# Before Django 3.0, saving a model with a UUID primary key runs an UPDATE before the INSERT.
+LOGIN_CODE_SAVE_QUERIES = 1 if django.VERSION >= (3, 0) else 2
+
 
 class TestLoginCodes(TestCase):
 
-    def setUp(self):
-        self.user = get_user_model().objects.create(username='test_user')
-        self.user2 = get_user_model().objects.create(username='test_user2')
-        self.inactive_user = get_user_model().objects.create(username='inactive', is_active=False)
-        self.loginCodeInstance = LoginCode(
-            id="2b6e8fa2c164f78bf37d998930e848968991f5bf9c36a92b591bf34a9540c11e", 
-            user=self.user,
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        # bulk_create() bypasses CustomUser.save(), so the login field is set explicitly.
+        users = User.objects.bulk_create([
+            User(username='test_user', new_username_field='test_user'),
+            User(username='test_user2', new_username_field='test_user2'),
+            User(username='inactive', new_username_field='inactive', is_active=False),
+        ])
+        # Not every backend returns primary keys from bulk_create(), so read the users back.
+        by_username = {
+            u.username: u
+            for u in User.objects.filter(username__in=[u.username for u in users])
+        }
+        cls.user, cls.user2, cls.inactive_user = [by_username[u.username] for u in users]
+        cls.loginCodeInstance = LoginCode(
+            id="2b6e8fa2c164f78bf37d998930e848968991f5bf9c36a92b591bf34a9540c11e",
+            user=cls.user,
             timestamp="2022-02-21 15:30:00"
             )
-        self.code = LoginCode.create_code_for_user(self.user)
 
-    def tearDown(self):
-        LoginCode.objects.all().delete()
-    
     def test_created_model(self):
-        self.assertEqual(len(self.loginCodeInstance.id), 64)
-        self.assertTrue(isinstance(self.loginCodeInstance.id, str))
-        self.assertEqual(self.loginCodeInstance.user, self.user)
-        self.assertEqual(self.loginCodeInstance.timestamp, "2022-02-21 15:30:00")
-        timestamp_recovered = datetime.strptime(self.loginCodeInstance.timestamp, "%Y-%m-%d %H:%M:%S")
-        self.assertTrue(isinstance(timestamp_recovered, datetime))
-        self.assertTrue(isinstance(self.loginCodeInstance.expires_at, datetime))
-        self.assertTrue(self.loginCodeInstance.expires_at>timezone.now() + timezone.timedelta(minutes=4, seconds=50))
-        self.assertTrue(self.loginCodeInstance.expires_at<timezone.now() + timezone.timedelta(minutes=5, seconds=1))
-        self.assertEqual(self.loginCodeInstance.next, "")
+        instance = self.loginCodeInstance
+        self.assertEqual({
+            'id_len': len(instance.id),
+            'id_type': type(instance.id),
+            'user': instance.user,
+            'timestamp': instance.timestamp,
+            'next': instance.next,
+        }, {
+            'id_len': 64,
+            'id_type': str,
+            'user': self.user,
+            'timestamp': "2022-02-21 15:30:00",
+            'next': "",
+        })
+        timestamp_recovered = datetime.strptime(instance.timestamp, "%Y-%m-%d %H:%M:%S")
+        self.assertIs(type(timestamp_recovered), datetime)
+        self.assertIs(type(instance.expires_at), datetime)
+        delta = instance.expires_at - timezone.now()
+        self.assertTrue(
+            timezone.timedelta(minutes=4, seconds=50) < delta
+            < timezone.timedelta(minutes=5, seconds=1)
+        )
 
     def test_login_backend(self):
-        self.assertEqual(len(self.code.code), 64)
-        self.assertIsNotNone(authenticate(username=self.user.username, code=self.code.code))
+        code = LoginCode.create_code_for_user(self.user)
+        self.assertEqual(len(code.code), 64)
+        with self.assertNumQueries(2):
+            self.assertIsNotNone(authenticate(username=self.user.username, code=code.code))
         self.assertIsNone(LoginCode.create_code_for_user(self.inactive_user))
     
-    @patch("nopassword.models.timezone.now")
-    def test_login_backend_after_expired_at(self, mock_now):
-        mock_now.return_value = timezone.datetime(2100, 1, 1, 0, 0, 1)
-        expired_login = LoginCode(
-            id="d5d9e97b-85b1-4e18-9c59-75ea31761945", 
-            user=self.user2, 
-            )
-        code = expired_login.create_code_for_user(self.user2)
-        self.assertIsNone(authenticate(username=self.user2.username, code=code))
+    def test_login_backend_after_expired_at(self):
+        code = LoginCode.create_code_for_user(self.user2)
+        # expires_at is naive local time, while time-machine reads naive datetimes as UTC.
+        expired = timezone.make_aware(code.expires_at + timezone.timedelta(seconds=1))
+        with time_machine.travel(expired):
+            self.assertIsNone(authenticate(username=self.user2.username, code=code.code))
 
     @override_settings(NOPASSWORD_NUMERIC_CODES=True)
     def test_numeric_code(self):
@@ -61,15 +83,25 @@ class TestLoginCodes(TestCase):
         self.assertTrue(code.code.isdigit())
 
     def test_next_value(self):
-        code = LoginCode.create_code_for_user(self.user, next='/secrets/')
+        with self.assertNumQueries(LOGIN_CODE_SAVE_QUERIES):
+            code = LoginCode.create_code_for_user(self.user, next='/secrets/')
         self.assertEqual(code.next, '/secrets/')
 
     @override_settings(NOPASSWORD_LOGIN_CODE_TIMEOUT=1)
     def test_code_timeout(self):
         timeout_code = LoginCode.create_code_for_user(self.user)
-        time.sleep(3)
-        self.assertIsNone(authenticate(username=self.user.username, code=timeout_code.code))
+        with time_machine.travel(time.time() + 3):
+            self.assertIsNone(authenticate(username=self.user.username, code=timeout_code.code))
+
+    def test_no_login_codes_left_over(self):
+        with self.assertNumQueries(1):
+            self.assertFalse(LoginCode.objects.exists())
+
+
+class TestLoginCodeStr(SimpleTestCase):
 
     def test_str(self):
-        code = LoginCode(user=self.user, timestamp=datetime(2018, 7, 1))
+        User = get_user_model()
+        user = User(**{User.USERNAME_FIELD: 'test_user'})
+        code = LoginCode(user=user, timestamp=datetime(2018, 7, 1))
         self.assertEqual(str(code), 'test_user - 2018-07-01 00:00:00')
@@ -1,8 +1,12 @@
 # -*- coding: utf8 -*-
-from unittest.mock import patch
+from datetime import timedelta
+
+import django
+import time_machine
 from django.contrib.auth import get_user_model
 from django.core import mail
-from django.test import TestCase, override_settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
 from django.utils import timezone
 
 from nopassword.models import LoginCode
@@ -10,17 +14,23 @@ from nopassword.models import LoginCode
 
 class TestViews(TestCase):
 
-    def setUp(self):
-        self.user = get_user_model().objects.create(username='user', email='foo@bar.com')
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(username='user', email='foo@bar.com')
+        cls.login_url = reverse('login')
+        cls.code_url = reverse('login_code')
+        cls.logout_url = reverse('logout')
 
     def test_request_login_code(self):
-        response = self.client.post('/accounts/login/', {
-            'username': self.user.username,
-            'next': '/private/',
-        })
+        # One user lookup plus saving the code, which takes an extra UPDATE before Django 3.0.
+        with self.assertNumQueries(2 if django.VERSION >= (3, 0) else 3):
+            response = self.client.post(self.login_url, {
+                'username': self.user.username,
+                'next': '/private/',
+            })
 
         self.assertEqual(response.status_code, 302)
-        self.assertEqual(response['Location'], '/accounts/login/code/')
+        self.assertEqual(response['Location'], self.code_url)
 
         login_code = LoginCode.objects.filter(user=self.user).first()
 
@@ -28,23 +38,16 @@ class TestViews(TestCase):
         self.assertEqual(login_code.next, '/private/')
         self.assertEqual(len(mail.outbox), 1)
         self.assertIn(
-            'http://testserver/accounts/login/code/?user={}&code={}'.format(
-                login_code.user.pk,
+            'http://testserver{}?user={}&code={}'.format(
+                self.code_url,
+                self.user.pk,
                 login_code.code
             ),
             mail.outbox[0].body,
         )
 
-    def test_request_login_code_missing_username(self):
-        response = self.client.post('/accounts/login/')
-
-        self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.context['form'].errors, {
-            'username': ['This field is required.'],
-        })
-
     def test_request_login_code_unknown_user(self):
-        response = self.client.post('/accounts/login/', {
+        response = self.client.post(self.login_url, {
             'username': 'unknown',
         })
 
@@ -54,10 +57,9 @@ class TestViews(TestCase):
         })
 
     def test_request_login_code_inactive_user(self):
-        self.user.is_active = False
-        self.user.save()
+        get_user_model().objects.filter(pk=self.user.pk).update(is_active=False)
 
-        response = self.client.post('/accounts/login/', {
+        response = self.client.post(self.login_url, {
             'username': self.user.username,
         })
 
@@ -69,10 +71,11 @@ class TestViews(TestCase):
     def test_login_post(self):
         login_code = LoginCode.objects.create(user=self.user, next='/private/')
 
-        response = self.client.post('/accounts/login/code/', {
-            'user': login_code.user.pk,
-            'code': login_code.code,
-        })
+        with self.assertNumQueries(11):
+            response = self.client.post(self.code_url, {
+                'user': login_code.user.pk,
+                'code': login_code.code,
+            })
 
         self.assertEqual(response.status_code, 302)
         self.assertEqual(response['Location'], '/private/')
@@ -82,7 +85,7 @@ class TestViews(TestCase):
     def test_login_get(self):
         login_code = LoginCode.objects.create(user=self.user)
 
-        response = self.client.get('/accounts/login/code/', {
+        response = self.client.get(self.code_url, {
             'user': login_code.user.pk,
             'code': login_code.code,
         })
@@ -92,32 +95,28 @@ class TestViews(TestCase):
         self.assertTrue(response.wsgi_request.user.is_anonymous)
         self.assertTrue(LoginCode.objects.filter(pk=login_code.pk).exists())
     
-    @patch("nopassword.models.timezone.now")
-    def test_login_get_with_expired_at(self, mock_now):
-        mock_now.return_value = timezone.datetime(2100, 1, 1, 0, 0, 1)
-        login_code = LoginCode.objects.create(user=self.user)
-        created_code= (login_code.create_code_for_user(self.user))
-
-        self.assertIsNone(created_code)
-
-        with self.assertRaises(TypeError) as assert_error:
-            response = self.client.get('/accounts/login/code/', {
-                'user': login_code.user.pk,
-                'code': created_code,
+    def test_login_get_with_expired_at(self):
+        login_code = LoginCode.create_code_for_user(self.user)
+        # expires_at is naive local time, while time-machine reads naive datetimes as UTC.
+        expired = timezone.make_aware(login_code.expires_at + timedelta(seconds=1))
+
+        with time_machine.travel(expired):
+            response = self.client.get(self.code_url, {
+                'user': self.user.pk,
+                'code': login_code.code,
             })
-            self.assertEqual(response.status_code, 302)
-
-        self.assertEqual(
-            assert_error.exception.args[0],
-            "Cannot encode None in a query string. Did you mean to pass an empty string or omit the value?"
-            )
 
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['form'].errors, {
+            '__all__': ['Unable to log in with provided login code.'],
+        })
+        self.assertTrue(response.wsgi_request.user.is_anonymous)
 
     @override_settings(NOPASSWORD_LOGIN_ON_GET=True)
     def test_login_get_non_idempotent(self):
         login_code = LoginCode.objects.create(user=self.user, next='/private/')
 
-        response = self.client.get('/accounts/login/code/', {
+        response = self.client.get(self.code_url, {
             'user': login_code.user.pk,
             'code': login_code.code,
         })
@@ -128,7 +127,7 @@ class TestViews(TestCase):
         self.assertTrue(LoginCode.objects.filter(pk=login_code.pk).exists())
 
     def test_login_missing_code_post(self):
-        response = self.client.post('/accounts/login/code/')
+        response = self.client.post(self.code_url)
 
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.context['form'].errors, {
@@ -138,13 +137,13 @@ class TestViews(TestCase):
         })
 
     def test_login_missing_code_get(self):
-        response = self.client.get('/accounts/login/code/')
+        response = self.client.get(self.code_url)
 
         self.assertEqual(response.status_code, 200)
         self.assertFalse(response.context['form'].is_bound)
 
     def test_login_unknown_code(self):
-        response = self.client.post('/accounts/login/code/', {
+        response = self.client.post(self.code_url, {
             'user': 1,
             'code': 'unknown',
         })
@@ -155,12 +154,11 @@ class TestViews(TestCase):
         })
 
     def test_login_inactive_user(self):
-        self.user.is_active = False
-        self.user.save()
+        get_user_model().objects.filter(pk=self.user.pk).update(is_active=False)
 
         login_code = LoginCode.objects.create(user=self.user)
 
-        response = self.client.post('/accounts/login/code/', {
+        response = self.client.post(self.code_url, {
             'user': login_code.user.pk,
             'code': login_code.code,
         })
@@ -175,10 +173,10 @@ class TestViews(TestCase):
 
         self.client.login(username=self.user.username, code=login_code.code)
 
-        response = self.client.post('/accounts/logout/?next=/accounts/login/')
+        response = self.client.post('{}?next={}'.format(self.logout_url, self.login_url))
 
         self.assertEqual(response.status_code, 302)
-        self.assertEqual(response['Location'], '/accounts/login/')
+        self.assertEqual(response['Location'], self.login_url)
         self.assertTrue(response.wsgi_request.user.is_anonymous)
 
     def test_logout_get(self):
@@ -186,8 +184,20 @@ class TestViews(TestCase):
 
         self.client.login(username=self.user.username, code=login_code.code)
 
-        response = self.client.post('/accounts/logout/?next=/accounts/login/')
+        with self.assertNumQueries(4):
+            response = self.client.get(self.logout_url, {'next': self.login_url})
 
         self.assertEqual(response.status_code, 302)
-        self.assertEqual(response['Location'], '/accounts/login/')
+        self.assertEqual(response['Location'], self.login_url)
         self.assertTrue(response.wsgi_request.user.is_anonymous)
+
+
+class TestLoginFormValidation(SimpleTestCase):
+
+    def test_request_login_code_missing_username(self):
+        response = self.client.post(reverse('login'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['form'].errors, {
+            'username': ['This field is required.'],
+        })